@@ -2,13 +2,31 @@ import os
 import sys
 from pathlib import Path
 
+import pytest
+
 ROOT = Path(__file__).resolve().parent
 
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
 os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+os.environ.setdefault("TESTING", "true")
 os.environ.setdefault("SECRET_KEY", "test-secret-key")
 os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
 os.environ.setdefault("ENVIRONMENT", "test")
 os.environ.setdefault("DEBUG", "true")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def in_memory_database():
+    # Verificar e inicializar la base de datos en memoria una sola vez
+    # por sesión (y por worker de xdist), fuera de la recolección
+    from src import models  # noqa: F401
+    from src.database import init_db
+    from src.settings import get_settings
+
+    settings = get_settings()
+    if settings.database_url != "sqlite:///:memory:":
+        message = "Tests deben usar base de datos SQLite en memoria"
+        raise RuntimeError(message)
+    init_db()
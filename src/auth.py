@@ -1,11 +1,19 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
 from datetime import datetime, timedelta
 from typing import Optional
-from jose import JWTError, jwt
+import anyio
+from cachetools import TLRUCache, TTLCache
+from jose import JWTError, jwk, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from sqlmodel import Session
-from .crud import get_user_by_username
+from .crud import get_user_by_username, get_user_by_username_cached
 from .database import get_session
 from .schemas import TokenData
 from .settings import get_settings
@@ -14,12 +22,54 @@ from .settings import get_settings
 # Obtener configuración
 settings = get_settings()
 SECRET_KEY = settings.secret_key.get_secret_value()
+SECRET_KEY_BYTES = SECRET_KEY.encode()
 ALGORITHM = "HS256"
+# Clave HMAC construida una sola vez y reutilizada al firmar y verificar
+SIGNING_KEY = jwk.construct(SECRET_KEY_BYTES, ALGORITHM)
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
+DEFAULT_EXPIRE = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+# Segundos mínimos de vigencia restante para reutilizar un token emitido
+TOKEN_REUSE_THRESHOLD = 60
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Menos rondas de bcrypt en tests (el mínimo) y test/desarrollo;
+# BCRYPT_ROUNDS permite ajustarlas explícitamente (p. ej. en staging)
+if settings.bcrypt_rounds is not None:
+    BCRYPT_ROUNDS = settings.bcrypt_rounds
+elif settings.testing:
+    BCRYPT_ROUNDS = 4
+elif settings.environment in ("test", "development"):
+    BCRYPT_ROUNDS = 8
+else:
+    BCRYPT_ROUNDS = 12
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS
+)
+# Resolver el backend de bcrypt al importar en lugar de en el primer login
+pwd_context.handler("bcrypt").get_backend()
+# Limitador propio para bcrypt: una ráfaga de logins espera en el event
+# loop por estos tokens en lugar de ocupar los del threadpool de FastAPI
+bcrypt_limiter = anyio.CapacityLimiter(max(1, (os.cpu_count() or 1) - 1))
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
 
+# Caches de autenticación. Los tokens se indexan por su hash SHA-256
+# para no guardar nunca el token en claro.
+_token_cache: TTLCache = TTLCache(maxsize=4096, ttl=30)
+# Verificaciones bcrypt exitosas: clave HMAC(usuario, sha256(contraseña))
+# -> hash almacenado en el momento de la verificación. Los fallos no
+# se guardan para no abaratar ataques de fuerza bruta.
+_verify_cache: TTLCache = TTLCache(maxsize=1024, ttl=300)
+# Último token emitido por usuario -> (token, exp). Cada entrada caduca
+# TOKEN_REUSE_THRESHOLD segundos antes que el propio token.
+_issued_tokens: TLRUCache = TLRUCache(
+    maxsize=1024,
+    ttu=lambda _key, value, _now: value[1] - TOKEN_REUSE_THRESHOLD,
+    timer=time.time
+)
+_cache_lock = threading.Lock()
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
@@ -29,22 +79,96 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta if expires_delta else timedelta(
-        minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+async def verify_password_async(
+        plain_password: str,
+        hashed_password: str
+) -> bool:
+    return await anyio.to_thread.run_sync(
+        pwd_context.verify,
+        plain_password,
+        hashed_password,
+        limiter=bcrypt_limiter
+    )
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await anyio.to_thread.run_sync(
+        pwd_context.hash,
+        password,
+        limiter=bcrypt_limiter
     )
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
 
 
-def authenticate_user(session: Session, username: str, password: str):
-    user = get_user_by_username(session, username)
+def create_access_token(
+        *,
+        sub: str,
+        expires_delta: Optional[timedelta] = None
+) -> str:
+    expire = datetime.utcnow() + (expires_delta or DEFAULT_EXPIRE)
+    return jwt.encode(
+        {"sub": sub, "exp": expire},
+        SIGNING_KEY,
+        algorithm=ALGORITHM
+    )
+
+
+def issue_access_token(username: str) -> str:
+    """Devolver el token vigente del usuario o emitir uno nuevo"""
+    with _cache_lock:
+        cached = _issued_tokens.get(username)
+    if cached is not None:
+        return cached[0]
+
+    exp = time.time() + DEFAULT_EXPIRE.total_seconds()
+    token = create_access_token(sub=username)
+    with _cache_lock:
+        _issued_tokens[username] = (token, exp)
+    return token
+
+
+def _decode_cached(token: str) -> dict:
+    """Decodificar un JWT reutilizando el payload si ya fue validado"""
+    key = hashlib.sha256(token.encode()).hexdigest()
+    with _cache_lock:
+        cached = _token_cache.get(key)
+    if cached is not None:
+        payload, exp = cached
+        if exp is None or exp > time.time():
+            return payload
+        with _cache_lock:
+            _token_cache.pop(key, None)
+
+    payload = jwt.decode(token, SIGNING_KEY, algorithms=[ALGORITHM])
+    with _cache_lock:
+        _token_cache[key] = (payload, payload.get("exp"))
+    return payload
+
+
+def _verify_cache_key(username: str, password: str) -> str:
+    password_digest = hashlib.sha256(password.encode()).hexdigest()
+    message = f"{username}:{password_digest}".encode()
+    return hmac.new(SECRET_KEY_BYTES, message, hashlib.sha256).hexdigest()
+
+
+async def authenticate_user(session: Session, username: str, password: str):
+    # La consulta va al threadpool y bcrypt a su limitador: nada bloquea
+    # el event loop
+    user = await run_in_threadpool(get_user_by_username, session, username)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+
+    key = _verify_cache_key(username, password)
+    with _cache_lock:
+        cached_hash = _verify_cache.get(key)
+    # Si la contraseña cambió, el hash en BD ya no coincide y se verifica
+    if cached_hash is not None and \
+            hmac.compare_digest(cached_hash, user.hashed_password):
+        return user
+
+    if not await verify_password_async(password, user.hashed_password):
         return None
+    with _cache_lock:
+        _verify_cache[key] = user.hashed_password
     return user
 
 
@@ -58,15 +182,14 @@ def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = _decode_cached(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = get_user_by_username(session, token_data.username) \
-        if token_data.username else None
+    user = get_user_by_username_cached(session, token_data.username)
     if user is None:
         raise credentials_exception
     return user
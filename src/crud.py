@@ -1,7 +1,40 @@
+import threading
 from typing import Optional, List, Tuple
+from cachetools import TTLCache
 from sqlmodel import Session, select
-from datetime import datetime
-from .models import User, Patient, PatientCreate, PatientUpdate
+from sqlalchemy import String, func, type_coerce, update
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import raiseload
+from .models import User, Patient, PatientCreate, PatientRead, PatientUpdate
+
+
+# Columnas devueltas por las consultas de solo lectura de pacientes
+_PATIENT_COLUMNS = (
+    Patient.id,
+    Patient.name,
+    Patient.age,
+    Patient.symptoms,
+    Patient.created_at,
+    Patient.updated_at,
+)
+
+# Usuarios por nombre de usuario, desvinculados de la sesión que los cargó
+_user_cache: TTLCache = TTLCache(maxsize=1024, ttl=60)
+_user_cache_lock = threading.Lock()
+
+
+def _count(session: Session, statement) -> int:
+    """
+    Contar las filas de un `select(Model).where(...)` con un COUNT en la
+    base de datos, sin traer las filas a Python.
+    """
+    count_statement = select(func.count()).select_from(statement.subquery())
+    return session.exec(count_statement).one()
+
+
+def _to_patient_read(row) -> PatientRead:
+    # Los datos vienen de la base de datos: se omite la validación
+    return PatientRead.model_construct(**row._mapping)
 
 
 def create_user(session: Session, username: str, hashed_password: str) -> User:
@@ -9,14 +42,49 @@ def create_user(session: Session, username: str, hashed_password: str) -> User:
     session.add(user)
     session.commit()
     session.refresh(user)
+    with _user_cache_lock:
+        _user_cache.pop(username, None)
     return user
 
 
-def get_user_by_username(session: Session, username: str) -> Optional[User]:
+def get_user_by_username(
+        session: Session,
+        username: str,
+        *load_options
+) -> Optional[User]:
+    """
+    Obtener un usuario por nombre. `load_options` permite indicar
+    estrategias de carga (p. ej. `selectinload`) para sus relaciones;
+    sin ellas, cualquier carga perezosa lanza un error en lugar de
+    generar consultas N+1.
+    """
     statement = select(User).where(User.username == username)
+    statement = statement.options(*(load_options or (raiseload("*"),)))
     return session.exec(statement).first()
 
 
+def get_user_by_username_cached(
+        session: Session,
+        username: str
+) -> Optional[User]:
+    """
+    Variante cacheada de `get_user_by_username` para la autenticación
+    por petición. El usuario se desvincula de la sesión para que los
+    commits posteriores no expiren sus atributos.
+    """
+    with _user_cache_lock:
+        user = _user_cache.get(username)
+    if user is not None:
+        return user
+
+    user = get_user_by_username(session, username)
+    if user is not None:
+        session.expunge(user)
+        with _user_cache_lock:
+            _user_cache[username] = user
+    return user
+
+
 def create_patient(session: Session, patient_in: PatientCreate) -> Patient:
     patient = Patient.model_validate(patient_in)
     session.add(patient)
@@ -25,28 +93,46 @@ def create_patient(session: Session, patient_in: PatientCreate) -> Patient:
     return patient
 
 
-def get_patient(session: Session, patient_id: int) -> Optional[Patient]:
-    return session.get(Patient, patient_id)
+def get_patient(session: Session, patient_id: int) -> Optional[PatientRead]:
+    """
+    Obtener un paciente por ID para lectura, sin pasar por el identity
+    map ni la instrumentación del ORM.
+    """
+    statement = select(*_PATIENT_COLUMNS).where(Patient.id == patient_id)
+    row = session.exec(statement).first()
+    return _to_patient_read(row) if row is not None else None
 
 
 def update_patient(
         session: Session,
         patient_id: int,
         patient_update: PatientUpdate
-) -> Optional[Patient]:
-    patient = session.get(Patient, patient_id)
-    if not patient:
-        return None
-
+) -> Optional[PatientRead]:
+    """
+    Actualizar un paciente con un único UPDATE ... RETURNING cuando el
+    motor lo soporta; en otro caso, UPDATE seguido de una lectura.
+    """
     update_data = patient_update.model_dump(exclude_unset=True)
-    if update_data:
-        update_data["updated_at"] = datetime.utcnow()
-        for field, value in update_data.items():
-            setattr(patient, field, value)
+    if not update_data:
+        return get_patient(session, patient_id)
+
+    statement = (
+        update(Patient)
+        .where(Patient.id == patient_id)
+        .values(**update_data)
+    )
+
+    if session.get_bind().dialect.update_returning:
+        statement = statement.returning(*_PATIENT_COLUMNS)
+        row = session.exec(statement).first()
         session.commit()
-        session.refresh(patient)
+        return _to_patient_read(row) if row is not None else None
 
-    return patient
+    result = session.exec(statement)
+    session.commit()
+    if result.rowcount == 0:
+        return None
+    return get_patient(session, patient_id)
 
 
 def delete_patient(session: Session, patient_id: int) -> bool:
@@ -59,6 +145,16 @@ def delete_patient(session: Session, patient_id: int) -> bool:
     return True
 
 
+def _symptom_filter(session: Session, symptom: str):
+    """
+    Filtro por síntoma: contención de ARRAY en PostgreSQL (usa el índice
+    GIN), búsqueda LIKE sobre el JSON serializado en el resto de motores.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        return type_coerce(Patient.symptoms, ARRAY(String)).contains([symptom])
+    return Patient.symptoms.like(f"%{symptom}%")
+
+
 def list_patients(
     session: Session,
     *,
@@ -68,50 +164,47 @@ def list_patients(
     symptom: Optional[str] = None,
     offset: int = 0,
     limit: int = 100
-) -> Tuple[List[Patient], int]:
+) -> Tuple[List[dict], int]:
     """
     Listado de pacientes con filtros y paginación.
-    Retorna una tupla de (pacientes, conteo_total)
+    Retorna una tupla de (pacientes, conteo_total); cada paciente es un
+    diccionario con las columnas de `PatientRead`, listo para serializar.
     """
-    # Construir query base
-    q = select(Patient)
-
-    # Aplicar filtros
+    # Construir filtros una sola vez y reutilizarlos en ambas consultas
+    filters = []
     if name:
-        q = q.where(Patient.name.ilike(f"%{name}%"))
+        filters.append(Patient.name.ilike(f"%{name}%"))
     if min_age is not None:
-        q = q.where(Patient.age >= min_age)
+        filters.append(Patient.age >= min_age)
     if max_age is not None:
-        q = q.where(Patient.age <= max_age)
+        filters.append(Patient.age <= max_age)
     if symptom:
-        q = q.where(Patient.symptoms.like(f"%{symptom}%"))
+        filters.append(_symptom_filter(session, symptom))
 
-    # Obtener total para paginación
-    count_query = select(Patient)
-    if name:
-        count_query = count_query.where(Patient.name.ilike(f"%{name}%"))
-    if min_age is not None:
-        count_query = count_query.where(Patient.age >= min_age)
-    if max_age is not None:
-        count_query = count_query.where(Patient.age <= max_age)
-    if symptom:
-        count_query = count_query.where(Patient.symptoms.like(f"%{symptom}%"))
-
-    total_count = len(session.exec(count_query).all())
+    statement = select(*_PATIENT_COLUMNS).where(*filters)
 
-    # Aplicar paginación
-    q = q.offset(offset).limit(limit)
+    # Obtener total para paginación con un COUNT en la base de datos
+    total_count = _count(session, statement)
 
-    # Ordenar por fecha de creación descendente
-    q = q.order_by(Patient.created_at.desc())
+    # Ordenar por fecha de creación descendente y paginar
+    q = (
+        statement
+        .order_by(Patient.created_at.desc(), Patient.id.desc())
+        .offset(offset)
+        .limit(limit)
+    )
 
-    patients = session.exec(q).all()
+    patients = [dict(row._mapping) for row in session.exec(q)]
     return patients, total_count
 
 
 def get_patients_by_symptom(session: Session, symptom: str) -> List[Patient]:
     """Obtener todos los pacientes que tienen un síntoma específico"""
-    statement = select(Patient).where(Patient.symptoms.like(f"%{symptom}%"))
+    statement = (
+        select(Patient)
+        .where(_symptom_filter(session, symptom))
+        .options(raiseload("*"))
+    )
     return session.exec(statement).all()
 
 
@@ -124,5 +217,5 @@ def get_patients_by_age_range(
     statement = select(Patient).where(
         Patient.age >= min_age,
         Patient.age <= max_age
-    )
+    ).options(raiseload("*"))
     return session.exec(statement).all()
@@ -2,7 +2,7 @@ import logging
 from typing import Generator
 from pathlib import Path
 from sqlmodel import SQLModel, create_engine, Session
-from sqlalchemy import text
+from sqlalchemy import event, text
 from .settings import get_settings
 from .database_utils import make_engine_from_url
 
@@ -36,6 +36,22 @@ if DATABASE_URL.startswith("sqlite"):
 engine, db_message = make_engine_from_url(DATABASE_URL, logger=logger)
 
 
+def _apply_testing_pragmas(dbapi_connection, connection_record) -> None:
+    """Desactivar journal y escrituras síncronas en la base de tests"""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=MEMORY")
+        cursor.execute("PRAGMA synchronous=OFF")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+
+# Se registra después de los PRAGMAs por defecto para sobrescribirlos
+if settings.testing and DATABASE_URL.startswith("sqlite"):
+    event.listen(engine, "connect", _apply_testing_pragmas)
+
+
 def init_db() -> None:
     """Inicializar la base de datos y crear tablas"""
     try:
@@ -65,8 +81,8 @@ def get_session() -> Generator[Session, None, None]:
 def check_db_connection() -> bool:
     """Verificar la conexión a la base de datos"""
     try:
-        with Session(engine) as session:
-            session.exec(text("SELECT 1"))
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
         return True
     except Exception as e:
         message = "Conexión a la base de datos fallida"
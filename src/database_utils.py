@@ -2,11 +2,44 @@
 from typing import Tuple, Optional
 import os
 import logging
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.engine import Engine
 from sqlalchemy.pool import StaticPool
 
 
+# PRAGMAs aplicados a cada conexión SQLite nueva
+# (con StaticPool, una sola vez)
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA foreign_keys=ON",
+)
+
+
+def _disable_pysqlite_transactions(
+    dbapi_connection, connection_record
+) -> None:
+    # pysqlite retrasa el BEGIN hasta la primera sentencia DML, lo que
+    # rompe los SAVEPOINTs; se desactiva y SQLAlchemy emite el BEGIN
+    dbapi_connection.isolation_level = None
+
+
+def _begin_sqlite_transaction(connection) -> None:
+    connection.exec_driver_sql("BEGIN")
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+
 def make_engine_from_url(
     database_url: str,
     logger: Optional[logging.Logger] = None,
@@ -14,7 +47,10 @@ def make_engine_from_url(
 ) -> Tuple[Engine, str]:
     """
     Crea y configura un Engine SQLAlchemy según el scheme de `database_url`.
-    - Para SQLite: aplica `connect_args`, `StaticPool` y `check_same_thread=False`.
+    - Para SQLite: aplica `connect_args`, `StaticPool` y
+      `check_same_thread=False`,
+      y configura WAL, mmap y caché mediante PRAGMAs al abrir cada conexión.
+      El BEGIN se emite explícitamente para que los SAVEPOINTs funcionen.
     - Para otros motores (Postgres/MySQL): aplica parámetros de pool más apropiados.
 
     Devuelve tupla: (engine, mensaje_log).
@@ -24,7 +60,12 @@ def make_engine_from_url(
       - logger: optional Logger. Si se provee, la función hará logger.info(message).
       - echo_env_var: nombre de la variable de entorno que controla `echo` (por defecto "SQL_ECHO").
 
+    Variables de entorno del pool (motores distintos de SQLite):
+      DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+      DB_POOL_USE_LIFO y, para PostgreSQL, DB_STATEMENT_TIMEOUT_MS.
+
     Nota: ajusta pool_size / max_overflow según la carga y el motor de BD en producción.
+    Como punto de partida, pool_size ≈ número de workers * 2.
     """
     echo_flag = os.getenv(echo_env_var, "false").lower() == "true"
 
@@ -39,16 +80,36 @@ def make_engine_from_url(
             poolclass=StaticPool,
             pool_pre_ping=True,
         )
+        event.listen(engine, "connect", _disable_pysqlite_transactions)
+        event.listen(engine, "connect", _apply_sqlite_pragmas)
+        event.listen(engine, "begin", _begin_sqlite_transaction)
         message = "Usando base de datos SQLite"
     else:
         # Valores razonables por defecto para bases de datos SQL (ajustar según necesidades)
+        connect_args = {}
+        if database_url.startswith("postgresql"):
+            statement_timeout = int(
+                os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000")
+            )
+            connect_args["options"] = (
+                f"-c statement_timeout={statement_timeout}"
+            )
+
         engine = create_engine(
             database_url,
             echo=echo_flag,
+            connect_args=connect_args,
             pool_pre_ping=True,
-            pool_recycle=3600,
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "3600")),
             pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
             max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+            pool_timeout=int(os.getenv("DB_POOL_TIMEOUT", "30")),
+            # LIFO reutiliza la conexión más reciente y deja que las
+            # ociosas expiren por pool_recycle
+            pool_use_lifo=(
+                os.getenv("DB_POOL_USE_LIFO", "true").lower() == "true"
+            ),
+            pool_reset_on_return="rollback",
         )
         message = "Usando base de datos SQL estándar"
 
@@ -2,17 +2,20 @@ from fastapi import FastAPI, Depends, HTTPException, Query, APIRouter
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+from fastapi.responses import ORJSONResponse
+from fastapi.concurrency import run_in_threadpool
 from typing import Optional
 from sqlmodel import Session
 from contextlib import asynccontextmanager
 
 import logging
 from .database import init_db, get_session, engine, check_db_connection
-from .models import Patient, PatientCreate, PatientUpdate, User, UserCreate
+from .models import Patient, PatientCreate, PatientRead, PatientUpdate, \
+    User, UserCreate
 from .crud import create_user, get_user_by_username, create_patient, \
     get_patient, list_patients, update_patient, delete_patient
-from .auth import get_password_hash, authenticate_user, create_access_token, \
-    get_current_user
+from .auth import get_password_hash_async, authenticate_user, \
+    issue_access_token, get_current_user
 from .settings import get_settings
 
 
@@ -67,6 +70,7 @@ app = FastAPI(
     description="API para gestión de pacientes",
     docs_url="/docs",
     redoc_url="/redoc",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -90,7 +94,10 @@ if settings.environment == "production":
 
 # Auth endpoints
 @auth_router.post("/register", response_model=dict, status_code=201)
-def register(user_in: UserCreate, session: Session = Depends(get_session)):
+async def register(
+    user_in: UserCreate,
+    session: Session = Depends(get_session)
+):
     username = user_in.username
     password = user_in.password
 
@@ -102,25 +109,35 @@ def register(user_in: UserCreate, session: Session = Depends(get_session)):
             detail=message
         )
 
-    existing = get_user_by_username(session, username)
+    # El acceso a la base de datos se ejecuta en el threadpool y bcrypt en
+    # su propio limitador, para no bloquear el event loop
+    existing = await run_in_threadpool(
+        get_user_by_username, session, username
+    )
     if existing:
         message = "El nombre de usuario ya existe"
         raise HTTPException(status_code=400, detail=message)
 
-    user = create_user(
+    hashed_password = await get_password_hash_async(password)
+    user = await run_in_threadpool(
+        create_user,
         session,
         username=username,
-        hashed_password=get_password_hash(password)
+        hashed_password=hashed_password
     )
     return {"username": user.username, "id": user.id}
 
 
 @auth_router.post("/login", response_model=dict)
-def login(
+async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
     session: Session = Depends(get_session)
 ):
-    user = authenticate_user(session, form_data.username, form_data.password)
+    user = await authenticate_user(
+        session,
+        form_data.username,
+        form_data.password
+    )
     if not user:
         message = "Nombre de usuario o contraseña incorrectos"
         raise HTTPException(
@@ -128,7 +145,7 @@ def login(
             detail=message,
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = create_access_token(data={"sub": user.username})
+    access_token = issue_access_token(user.username)
     return {"access_token": access_token, "token_type": "bearer"}
 
 
@@ -142,7 +159,7 @@ def endpoint_create_patient(
     return create_patient(session, patient_in)
 
 
-@patients_router.get("", response_model=dict)
+@patients_router.get("", response_model=None)
 def endpoint_list_patients(
     name: Optional[str] = Query(None, description="Filtrar por nombre"),
     min_age: Optional[int] = Query(None, ge=0, le=120, description="Edad mínima"),
@@ -162,16 +179,18 @@ def endpoint_list_patients(
         offset=offset,
         limit=limit
     )
-    return {
+    # Las filas ya vienen de la base de datos: se serializan
+    # directamente con orjson, sin pasar por pydantic
+    return ORJSONResponse({
         "patients": patients,
         "total_count": total_count,
         "offset": offset,
         "limit": limit,
         "has_more": offset + limit < total_count
-    }
+    })
 
 
-@patients_router.get("/{patient_id}", response_model=Patient)
+@patients_router.get("/{patient_id}", response_model=PatientRead)
 def endpoint_get_patient(
     patient_id: int,
     session: Session = Depends(get_session),
@@ -184,7 +203,7 @@ def endpoint_get_patient(
     return patient
 
 
-@patients_router.put("/{patient_id}", response_model=Patient)
+@patients_router.put("/{patient_id}", response_model=PatientRead)
 def endpoint_update_patient(
     patient_id: int,
     patient_update: PatientUpdate,
@@ -1,10 +1,35 @@
 from typing import Optional, List, Annotated
 from datetime import datetime
 from sqlmodel import SQLModel, Field
-from sqlalchemy import Column, JSON
+from sqlalchemy import Column, DateTime, Index, JSON, String
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
 from pydantic import field_validator, StringConstraints
 
 
+class utcnow(FunctionElement):
+    """Hora UTC actual calculada por la base de datos, con fracciones
+    de segundo (CURRENT_TIMESTAMP de SQLite sólo llega al segundo)"""
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def _default_utcnow(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(utcnow, "postgresql")
+def _pg_utcnow(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+
+@compiles(utcnow, "sqlite")
+def _sqlite_utcnow(element, compiler, **kw):
+    return "STRFTIME('%Y-%m-%d %H:%M:%f', 'now')"
+
+
 class PatientBase(SQLModel):
     name: Annotated[str, StringConstraints(
         min_length=1,
@@ -20,7 +45,9 @@ class PatientBase(SQLModel):
     )
     symptoms: Optional[List[str]] = Field(
         default_factory=list,
-        sa_column=Column(JSON),
+        sa_column=Column(
+            JSON().with_variant(ARRAY(String), "postgresql")
+        ),
         description="Listado de síntomas del paciente"
     )
 
@@ -40,16 +67,48 @@ class PatientBase(SQLModel):
 
 class Patient(PatientBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    created_at: datetime = Field(
-        default_factory=datetime.utcnow,
+    # `default` escribe utcnow() en el propio INSERT: las tablas creadas
+    # antes de `server_default` (create_all no las altera) siguen funcionando
+    created_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(
+            DateTime,
+            default=utcnow(),
+            server_default=utcnow(),
+            nullable=False
+        ),
         description="Hora de creación del registro"
     )
-    updated_at: datetime = Field(
-        default_factory=datetime.utcnow,
+    updated_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(
+            DateTime,
+            default=utcnow(),
+            server_default=utcnow(),
+            onupdate=utcnow(),
+            nullable=False
+        ),
         description="Hora de la última actualización del registro"
     )
 
 
+class PatientRead(PatientBase):
+    id: int
+    created_at: datetime
+    updated_at: datetime
+
+
+# Índices para el listado: orden por fecha, filtro por edad y GIN sobre
+# síntomas en PostgreSQL
+Index("ix_patient_created_at", Patient.created_at.desc())
+Index("ix_patient_age", Patient.age)
+Index(
+    "ix_patient_symptoms_gin",
+    Patient.symptoms,
+    postgresql_using="gin"
+).ddl_if(dialect="postgresql")
+
+
 class PatientCreate(PatientBase):
     pass
 
@@ -80,8 +139,14 @@ class User(UserBase, table=True):
         default=True,
         description="Verifica si la cuenta de usuario está activa"
     )
-    created_at: datetime = Field(
-        default_factory=datetime.utcnow,
+    created_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(
+            DateTime,
+            default=utcnow(),
+            server_default=utcnow(),
+            nullable=False
+        ),
         description="Hora de creación del usuario"
     )
 
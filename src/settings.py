@@ -1,6 +1,7 @@
+from functools import lru_cache
 from pydantic import SecretStr, Field, field_validator
 from pydantic_settings import BaseSettings
-from typing import Any, Callable, Dict, Tuple
+from typing import Any, Callable, Dict, Optional, Tuple
 
 
 class Settings(BaseSettings):
@@ -21,6 +22,13 @@ class Settings(BaseSettings):
         description="Entorno: development, staging, production"
     )
     debug: bool = Field(False, description="Modo debug")
+    testing: bool = Field(False, description="Ejecución de la suite de tests")
+    bcrypt_rounds: Optional[int] = Field(
+        None,
+        ge=4,
+        le=31,
+        description="Rondas de bcrypt (por defecto según el entorno)"
+    )
 
     model_config = {
         "env_file": ".env",
@@ -44,7 +52,7 @@ class Settings(BaseSettings):
         return int(v)
 
 
-    @field_validator("debug", mode="before")
+    @field_validator("debug", "testing", mode="before")
     def _parse_debug(cls, v):
         if isinstance(v, str):
             s = v.strip().lower()
@@ -123,15 +131,12 @@ class Settings(BaseSettings):
 
 
 
-_settings: Settings | None = None
-
+@lru_cache(maxsize=1)
 def get_settings() -> Settings:
-    global _settings
-    if _settings is None:
-        _settings = Settings()
+    settings = Settings()
 
-        if not _settings.secret_key.get_secret_value():
-            message = "SECRET_KEY es obligatorio y \
-                no puede estar vacío."
-            raise RuntimeError(message)
-    return _settings
+    if not settings.secret_key.get_secret_value():
+        message = "SECRET_KEY es obligatorio y \
+            no puede estar vacío."
+        raise RuntimeError(message)
+    return settings
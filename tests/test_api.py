@@ -1,63 +1,97 @@
+import hashlib
+import time
+from datetime import timedelta
+
+import orjson
 import pytest
-from fastapi.testclient import TestClient
+import pytest_asyncio
+from httpx import ASGITransport, AsyncClient
 
+import src.auth as auth
 import src.main as app_main
-from src.database import init_db, engine
-from src.settings import get_settings
-from sqlmodel import SQLModel
+from src.database import engine, get_session
+from src.database_utils import make_engine_from_url
+from src.auth import authenticate_user, create_access_token, \
+    get_password_hash, issue_access_token
+from src.models import Patient, User
+from sqlmodel import SQLModel, Session
 
 
-# Inicializar DB en memoria para tests
-settings = get_settings()
-if settings.database_url != "sqlite:///:memory:":
-    message = "Tests deben usar base de datos SQLite en memoria"
-    raise RuntimeError(message)
-init_db()
+# Hash de "testpass123" calculado una única vez al importar
+PRECOMPUTED_HASH = get_password_hash("testpass123")
 
+# Los cuerpos JSON se serializan con orjson y se envían con `content=`
+JSON_HEADERS = {"content-type": "application/json"}
 
-@pytest.fixture(autouse=True)
-def setup_db():
-    # Crear tablas antes de cada test
-    SQLModel.metadata.create_all(engine)
-    yield
-    # Opcional: limpiar datos después de cada test
-    SQLModel.metadata.drop_all(engine)
 
+@pytest_asyncio.fixture(scope="session")
+async def client():
+    # Un único cliente para toda la sesión: el lifespan corre una sola vez
+    # y las peticiones se despachan directamente sobre la app ASGI
+    transport = ASGITransport(app=app_main.app)
+    async with app_main.app.router.lifespan_context(app_main.app):
+        async with AsyncClient(
+            transport=transport,
+            base_url="http://testserver"
+        ) as client:
+            yield client
 
-@pytest.fixture
-def client():
-    client = TestClient(app_main.app)
-    yield client
 
+@pytest.fixture(scope="session")
+def connection(client):
+    # Transacción externa para toda la sesión; se abre después del
+    # lifespan del cliente y se revierte antes de su cierre
+    connection = engine.connect()
+    trans = connection.begin()
+    yield connection
+    trans.rollback()
+    connection.close()
 
-@pytest.fixture
-def auth_headers(client):
-    # Registrar y loguear un usuario para obtener token
-    client.post(
-        "/api/v1/auth/register",
-        json={
-            "username":"testuser",
-            "password":"testpass123"
-        }
-    )
-    r = client.post(
-        "/api/v1/auth/login",
-        data={
-            "username":"testuser",
-            "password":"testpass123"
-        }
+
+@pytest.fixture(autouse=True)
+def db_session(request, connection):
+    # Cada test corre dentro de un SAVEPOINT que se revierte al final;
+    # los commits de la aplicación sólo liberan SAVEPOINTs internos
+    nested = connection.begin_nested()
+    if request.node.get_closest_marker("fresh_db"):
+        # Vaciar las tablas dentro del SAVEPOINT: el test parte de una
+        # base vacía y los datos compartidos vuelven con el rollback
+        for table in reversed(SQLModel.metadata.sorted_tables):
+            connection.execute(table.delete())
+    session = Session(
+        bind=connection, join_transaction_mode="create_savepoint"
     )
-    token = r.json()["access_token"]
+    app_main.app.dependency_overrides[get_session] = lambda: session
+    yield session
+    app_main.app.dependency_overrides.pop(get_session, None)
+    session.close()
+    nested.rollback()
+
+
+@pytest.fixture(scope="session")
+def auth_headers(connection):
+    # Crear el usuario directamente con el ORM una sola vez por sesión, en
+    # la transacción externa, y emitir su token sin pasar por HTTP
+    with Session(
+        bind=connection,
+        join_transaction_mode="create_savepoint"
+    ) as session:
+        session.add(User(
+            username="testuser",
+            hashed_password=PRECOMPUTED_HASH
+        ))
+        session.commit()
+    token = issue_access_token("testuser")
     return {"Authorization": f"Bearer {token}"}
 
 
-def test_register_login_and_patient_flow(client, auth_headers):
+async def test_register_login_and_patient_flow(client, auth_headers):
     # Crear paciente
     patient_payload = {"name":"Bob","age":40,"symptoms":["fever","cough"]}
-    r = client.post(
+    r = await client.post(
         "/api/v1/patients",
-        json=patient_payload,
-        headers=auth_headers
+        content=orjson.dumps(patient_payload),
+        headers={**auth_headers, **JSON_HEADERS}
     )
     assert r.status_code == 201
     created = r.json()
@@ -66,7 +100,7 @@ def test_register_login_and_patient_flow(client, auth_headers):
     assert created["symptoms"] == ["fever", "cough"]
 
     # Listar pacientes
-    r = client.get("/api/v1/patients", headers=auth_headers)
+    r = await client.get("/api/v1/patients", headers=auth_headers)
     assert r.status_code == 200
     data = r.json()
     assert "patients" in data
@@ -75,55 +109,152 @@ def test_register_login_and_patient_flow(client, auth_headers):
 
     # Obtener paciente por ID
     pid = created["id"]
-    r = client.get(f"/api/v1/patients/{pid}", headers=auth_headers)
+    r = await client.get(f"/api/v1/patients/{pid}", headers=auth_headers)
     assert r.status_code == 200
     got = r.json()
     assert got["id"] == pid
 
 
-def test_register_validation(client):
+async def test_login_reuses_valid_token(client, auth_headers):
+    # Un segundo login dentro de la ventana de validez reutiliza el token
+    r = await client.post(
+        "/api/v1/auth/login",
+        data={
+            "username":"testuser",
+            "password":"testpass123"
+        }
+    )
+    assert r.status_code == 200
+    token = r.json()["access_token"]
+    assert auth_headers["Authorization"] == f"Bearer {token}"
+
+
+async def test_cached_token_expires(client, auth_headers):
+    # Un token cuyo payload sigue en la caché (TTL de 30 s) se rechaza en
+    # cuanto vence su `exp`
+    token = create_access_token(
+        sub="testuser",
+        expires_delta=timedelta(seconds=1)
+    )
+    headers = {"Authorization": f"Bearer {token}"}
+    r = await client.get("/api/v1/patients", headers=headers)
+    assert r.status_code == 200
+    exp = auth._token_cache[hashlib.sha256(token.encode()).hexdigest()][1]
+
+    # jose compara segundos enteros: el token vence pasado el segundo `exp`
+    time.sleep(max(0, exp + 1 - time.time()) + 0.05)
+    r = await client.get("/api/v1/patients", headers=headers)
+    assert r.status_code == 401
+
+    # Un token manipulado no supera la verificación de la firma
+    r = await client.get(
+        "/api/v1/patients",
+        headers={"Authorization": f"Bearer {token[:-2]}xx"}
+    )
+    assert r.status_code == 401
+
+
+async def test_verify_cache_only_keeps_successes(db_session):
+    db_session.add(User(
+        username="cacheuser",
+        hashed_password=PRECOMPUTED_HASH
+    ))
+    db_session.commit()
+
+    # Una verificación fallida no se guarda en la caché
+    assert await authenticate_user(db_session, "cacheuser", "wrongpass1") \
+        is None
+    failed_key = auth._verify_cache_key("cacheuser", "wrongpass1")
+    assert failed_key not in auth._verify_cache
+
+    # Tras un acierto cacheado, otra contraseña sigue siendo rechazada
+    user = await authenticate_user(db_session, "cacheuser", "testpass123")
+    assert user is not None
+    assert auth._verify_cache_key("cacheuser", "testpass123") \
+        in auth._verify_cache
+    assert await authenticate_user(db_session, "cacheuser", "wrongpass1") \
+        is None
+
+
+async def test_verify_cache_rechecks_changed_hash(db_session):
+    user = User(username="rotateuser", hashed_password=PRECOMPUTED_HASH)
+    db_session.add(user)
+    db_session.commit()
+    assert await authenticate_user(db_session, "rotateuser", "testpass123")
+
+    # Cambiar la contraseña en BD invalida el acierto cacheado
+    user.hashed_password = get_password_hash("newpass123")
+    db_session.add(user)
+    db_session.commit()
+    assert await authenticate_user(db_session, "rotateuser", "testpass123") \
+        is None
+    assert await authenticate_user(db_session, "rotateuser", "newpass123")
+
+
+@pytest.mark.fresh_db
+async def test_register_validation(client):
     # Test password muy corto
-    r = client.post(
+    r = await client.post(
         "/api/v1/auth/register",
-        json={
+        content=orjson.dumps({
             "username":"test",
             "password":"123"
-        }
+        }),
+        headers=JSON_HEADERS
     )
     assert r.status_code == 422
-    errors = r.json()["detail"]
-    password_error = next((error for error in errors \
-                           if error["loc"][-1] == "password"), None)
+    errors_by_field = {
+        error["loc"][-1]: error for error in r.json()["detail"]
+    }
+    password_error = errors_by_field.get("password")
     assert password_error is not None
     assert "at least 8" in password_error["msg"].lower()
 
     # Test nombre de usuario duplicado
-    client.post(
+    alice = orjson.dumps({
+        "username":"alice",
+        "password":"password123"
+    })
+    r = await client.post(
         "/api/v1/auth/register",
-        json={
-            "username":"alice",
-            "password":"password123"
-        }
+        content=alice,
+        headers=JSON_HEADERS
     )
-    r = client.post(
+    assert r.status_code == 201
+    r = await client.post(
         "/api/v1/auth/register",
-        json={
-            "username":"alice",
-            "password":"password123"
-        }
+        content=alice,
+        headers=JSON_HEADERS
     )
     assert r.status_code == 400
     message = "El nombre de usuario ya existe"
     assert message in r.json()["detail"]
 
 
-def test_patient_crud_operations(client, auth_headers):
+async def test_list_patients_newest_first(client, auth_headers):
+    # Los pacientes se listan del más reciente al más antiguo
+    names = [f"Order {i}" for i in range(6)]
+    for name in names:
+        r = await client.post(
+            "/api/v1/patients",
+            content=orjson.dumps({"name":name,"age":30}),
+            headers={**auth_headers, **JSON_HEADERS}
+        )
+        assert r.status_code == 201
+
+    r = await client.get("/api/v1/patients?name=Order", headers=auth_headers)
+    assert r.status_code == 200
+    listed = [p["name"] for p in r.json()["patients"]]
+    assert listed == list(reversed(names))
+
+
+async def test_patient_crud_operations(client, auth_headers):
     # Crear paciente
     patient_data = {"name":"John Doe","age":30,"symptoms":["headache"]}
-    r = client.post(
+    r = await client.post(
         "/api/v1/patients",
-        json=patient_data,
-        headers=auth_headers
+        content=orjson.dumps(patient_data),
+        headers={**auth_headers, **JSON_HEADERS}
     )
     assert r.status_code == 201
     patient = r.json()
@@ -131,10 +262,10 @@ def test_patient_crud_operations(client, auth_headers):
 
     # Actualizar paciente
     update_data = {"age": 31, "symptoms": ["headache", "fever"]}
-    r = client.put(
+    r = await client.put(
         f"/api/v1/patients/{patient_id}",
-        json=update_data,
-        headers=auth_headers
+        content=orjson.dumps(update_data),
+        headers={**auth_headers, **JSON_HEADERS}
     )
     assert r.status_code == 200
     updated = r.json()
@@ -142,50 +273,105 @@ def test_patient_crud_operations(client, auth_headers):
     assert "fever" in updated["symptoms"]
 
     # Eliminar paciente
-    r = client.delete(f"/api/v1/patients/{patient_id}", headers=auth_headers)
+    r = await client.delete(
+        f"/api/v1/patients/{patient_id}",
+        headers=auth_headers
+    )
     assert r.status_code == 204
 
     # Verificar eliminación del paciente
-    r = client.get(f"/api/v1/patients/{patient_id}", headers=auth_headers)
+    r = await client.get(
+        f"/api/v1/patients/{patient_id}",
+        headers=auth_headers
+    )
     assert r.status_code == 404
 
 
-def test_patient_filtering(client, auth_headers):
-    # Crear varios pacientes
+@pytest.fixture(scope="class")
+def seeded_patients(connection):
+    # Pacientes compartidos por los casos de filtrado: se insertan una vez
+    # por clase en un SAVEPOINT propio que se revierte al terminarla, así
+    # los datos no llegan al resto de tests
+    nested = connection.begin_nested()
     patients = [
         {"name":"Alice","age":25,"symptoms":["fever"]},
         {"name":"Bob","age":35,"symptoms":["cough"]},
         {"name":"Charlie","age":45,"symptoms":["fever","cough"]}
     ]
-    
-    for patient in patients:
-        client.post("/api/v1/patients", json=patient, headers=auth_headers)
+    with Session(
+        bind=connection,
+        join_transaction_mode="create_savepoint"
+    ) as session:
+        session.add_all([Patient(**patient) for patient in patients])
+        session.commit()
+    yield patients
+    nested.rollback()
 
-    # Test filtro por edad
-    r = client.get("/api/v1/patients?min_age=30", headers=auth_headers)
-    assert r.status_code == 200
-    data = r.json()
-    assert all(p["age"] >= 30 for p in data["patients"])
 
-    # Test filtro por síntoma
-    r = client.get("/api/v1/patients?symptom=fever", headers=auth_headers)
-    assert r.status_code == 200
-    data = r.json()
-    assert all("fever" in p["symptoms"] for p in data["patients"])
+class TestPatientFiltering:
+    @pytest.mark.parametrize(
+        "query, predicate, expected_count",
+        [
+            # Filtro por edad
+            ("min_age=30", lambda p: p["age"] >= 30, 2),
+            # Filtro por síntoma
+            ("symptom=fever", lambda p: "fever" in p["symptoms"], 2),
+            # Filtro por nombre sin distinguir mayúsculas
+            ("name=aLiCe", lambda p: p["name"] == "Alice", 1),
+        ]
+    )
+    async def test_patient_filtering(
+        self,
+        client,
+        auth_headers,
+        seeded_patients,
+        query,
+        predicate,
+        expected_count
+    ):
+        r = await client.get(
+            f"/api/v1/patients?{query}", headers=auth_headers
+        )
+        assert r.status_code == 200
+        data = r.json()
+        assert all(predicate(p) for p in data["patients"])
+        assert len(data["patients"]) == expected_count
+        assert data["total_count"] == expected_count
 
 
-def test_authentication_required(client):
+async def test_authentication_required(client):
     # Intentar acceder sin token
-    r = client.get("/api/v1/patients")
+    r = await client.get("/api/v1/patients")
     assert r.status_code == 401
 
-    r = client.post("/api/v1/patients", json={"name":"Test","age":30})
+    r = await client.post(
+        "/api/v1/patients",
+        content=orjson.dumps({"name":"Test","age":30}),
+        headers=JSON_HEADERS
+    )
     assert r.status_code == 401
 
 
-def test_health_check(client):
-    r = client.get("/api/v1/health")
+async def test_health_check(client):
+    r = await client.get("/api/v1/health")
     assert r.status_code == 200
     data = r.json()
     assert data["status"] == "healthy"
     assert "version" in data
+
+
+def test_in_memory_engine_shares_one_connection():
+    # Los fixtures de transacción asumen que la app y los tests comparten
+    # la misma base de datos en memoria: toda conexión del engine debe
+    # envolver la misma conexión DBAPI. Se usa un engine propio para no
+    # devolver al pool (y revertir) la conexión de los fixtures.
+    memory_engine, _ = make_engine_from_url("sqlite:///:memory:")
+    try:
+        with memory_engine.connect() as first, \
+                memory_engine.connect() as second:
+            assert (
+                first.connection.dbapi_connection
+                is second.connection.dbapi_connection
+            )
+    finally:
+        memory_engine.dispose()